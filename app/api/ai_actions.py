@@ -3,28 +3,37 @@ This module contains the AIActions class which is responsible for creating detai
 """
 
 # External Libraries
-import openai
 from dotenv import load_dotenv
+import httpx
+from openai import AsyncOpenAI
 from llama_index import PromptTemplate
-from llama_index.llms import OpenAI
 from llama_index.multi_modal_llms import OpenAIMultiModal
-from llama_index.query_engine import SimpleMultiModalQueryEngine
-from llama_index.indices.multi_modal.retriever import (
-    MultiModalVectorIndexRetriever,
+from llama_index.schema import ImageNode, NodeWithScore
+from llama_index.vector_stores.types import (
+    MetadataFilter,
+    MetadataFilters,
+    VectorStore as BaseVectorStore,
+    VectorStoreQuery,
 )
-from llama_index.vector_stores.types import MetadataFilter, MetadataFilters
 
 # Local Libraries
 from app.db.vector_stores import VectorStore
+from app.utils.response_cache import summary_cache
 
 # Default Python Libraries
+from typing import AsyncGenerator
+import asyncio
+import logging
 import os
 
 # Load environment variables
 load_dotenv()
 
-# Set OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
+
+# Bounds the number of concurrent completion requests to stay under rate limits
+OPENAI_CONCURRENCY_LIMIT = int(os.getenv("OPENAI_CONCURRENCY_LIMIT", "8"))
+_llm_semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY_LIMIT)
 
 
 class AIActions:
@@ -32,30 +41,88 @@ class AIActions:
     AIActions is a class that provides methods for creating detailed analysis prompts and summarizing user data.
     """
 
-    @classmethod
-    async def get_instance(cls):
-        """
-        Returns an instance of AIActions. If it doesn't exist, it creates one.
-        """
-        self = cls()
-        await self._async_init()
-        return self
+    # Static prompts are built once at import instead of on every request.
+    # The static instructions come first and the per-user context last so the
+    # prompt prefix is identical across requests and can hit OpenAI's prompt cache.
+    _IMAGE_QA_TMPL = PromptTemplate(
+        "Given the context information and no prior knowledge, "
+        "answer the query as in depth as you possibly can.\n"
+        "Query: {query_str}\n"
+        "Context information is below.\n"
+        "-----------------------------\n"
+        "{context_str}"
+        "-----------------------------\n"
+        "Answer: "
+    )
+    _RETRIEVAL_QUERY_STR = (
+        "Find images provided by the user to create a summary of them."
+    )
+    _SUMMARY_QUERY_STR = (
+        "Analyze your knowledgebase of images for the user to create a "
+        "summary of them."
+    )
+    _SIMILARITY_TOP_K = 2
+    _retrieval_query_embeddings: list[list[float]] | None = None
+    _instance: "AIActions | None" = None
+    _multi_modal_agent: OpenAIMultiModal | None = None
+    _http_client: httpx.AsyncClient | None = None
 
-    def __init__(self):
+    @classmethod
+    async def init(cls):
         """
-        Initializes an instance of AIActions and sets the vector store.
+        Creates the OpenAI client shared by every instance, with one HTTP/2 connection pool for all
+        completion requests in the process. Called on server startup and closed again on shutdown.
         """
-        self._agent = OpenAI(
-            model="gpt-4-1106-preview",
-            temperature=0.0,
+        if cls._multi_modal_agent is not None:
+            return
+        cls._http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=200, max_keepalive_connections=50
+            ),
         )
-        self._multi_modal_agent = OpenAIMultiModal(
+        agent = OpenAIMultiModal(
             model="gpt-4-vision-preview",
             temperature=0.0,
             api_key=os.getenv("OPENAI_API_KEY"),
             max_new_tokens=1500,
             context_window=100000,
         )
+        # llama-index hands a single http_client to both its sync and async
+        # OpenAI clients, so the pool is given to the async one directly
+        agent._aclient = AsyncOpenAI(
+            **agent._get_credential_kwargs(http_client=cls._http_client)
+        )
+        cls._multi_modal_agent = agent
+
+    @classmethod
+    async def close(cls):
+        """
+        Closes the OpenAI connection pool. Called on server shutdown.
+        """
+        if cls._http_client is not None:
+            await cls._http_client.aclose()
+        cls._http_client = None
+        cls._multi_modal_agent = None
+
+    @classmethod
+    async def get_instance(cls):
+        """
+        Returns an instance of AIActions. If it doesn't exist, it creates one.
+        The instance holds no per-request state, so it is created once and reused.
+        """
+        await cls.init()
+        if cls._instance is None:
+            self = cls()
+            await self._async_init()
+            cls._instance = self
+        return cls._instance
+
+    def __init__(self):
+        """
+        Initializes an instance of AIActions and sets the vector store.
+        The OpenAI client is a class attribute shared by every instance.
+        """
         self.vector_store: VectorStore | None = None
 
     async def _async_init(self):
@@ -68,66 +135,240 @@ class AIActions:
         """
         Summarize the detailed personality traits of the user based on their vector storage.
         """
-        try:
-            assert self.vector_store is not None
-        except:
+        if self.vector_store is None:
             return None
-        # Initialize or get the user's index and create detailed prompts
+        nodes = await self._retrieve_nodes(user_id)
+
+        # The summary only changes when the retrieved nodes do, so reuse it
+        cache_key = self._summary_cache_key(user_id, nodes)
+        cached_response = await summary_cache.lookup(cache_key)
+        if cached_response is not None:
+            return cached_response
+
+        # Synthesize from the nodes retrieved above rather than retrieving again
+        prompt, image_documents = self._build_prompt(nodes)
+        async with _llm_semaphore:
+            ai_response = await self._multi_modal_agent.acomplete(
+                prompt=prompt,
+                image_documents=image_documents,
+                # Keeps OpenAI's prompt-cache routing sticky per user
+                user=user_id,
+            )
+
+        # Finally get the response
+        response = str(ai_response)
+        await summary_cache.update(cache_key, user_id, response)
+        return response
+
+    async def stream_summary(self, user_id: str) -> AsyncGenerator[str, None]:
+        """
+        Stream the summary of the user as it is generated, so callers can start sending it before the model finishes.
+        A cached summary is yielded in one piece.
+        """
+        if self.vector_store is None:
+            return
+        nodes = await self._retrieve_nodes(user_id)
+        cache_key = self._summary_cache_key(user_id, nodes)
+        cached_response = await summary_cache.lookup(cache_key)
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        prompt, image_documents = self._build_prompt(nodes)
+        # The completion is read into a queue by its own task, so the
+        # concurrency slot is released as soon as the model finishes rather
+        # than when a slow client has read the whole stream
+        queue: asyncio.Queue[str | Exception | None] = asyncio.Queue()
+        producer = asyncio.create_task(
+            self._stream_deltas(prompt, image_documents, user_id, queue)
+        )
+        deltas: list[str] = []
+        try:
+            while (delta := await queue.get()) is not None:
+                if isinstance(delta, Exception):
+                    raise delta
+                deltas.append(delta)
+                yield delta
+        finally:
+            # Stops the completion if the client went away mid-stream
+            producer.cancel()
+        await summary_cache.update(cache_key, user_id, "".join(deltas))
+
+    async def _stream_deltas(
+        self,
+        prompt: str,
+        image_documents: list[ImageNode],
+        user_id: str,
+        queue: "asyncio.Queue[str | Exception | None]",
+    ) -> None:
+        """
+        Stream a completion into the queue, holding a concurrency slot only while the model is generating.
+        The stream ends with None, or with the exception that interrupted it.
+        """
+        try:
+            async with _llm_semaphore:
+                response_gen = await self._multi_modal_agent.astream_complete(
+                    prompt=prompt,
+                    image_documents=image_documents,
+                    user=user_id,
+                )
+                async for chunk in response_gen:
+                    if chunk.delta:
+                        queue.put_nowait(chunk.delta)
+        except Exception as e:
+            queue.put_nowait(e)
+            return
+        queue.put_nowait(None)
+
+    async def summarize_users_batch(
+        self, user_ids: list[str]
+    ) -> dict[str, str | None]:
+        """
+        Summarize several users at once, e.g. for a backfill. At most OPENAI_CONCURRENCY_LIMIT users are
+        summarized at a time, from retrieval through generation.
+
+        Args:
+            user_ids (list[str]): The user IDs to summarize.
+
+        Returns:
+            dict[str, str | None]: The summary for each user, or None if it could not be generated.
+        """
+        unique_user_ids = list(dict.fromkeys(user_ids))
+        # Bound whole summaries, not just the completion call, so a backfill
+        # doesn't start a retrieval and user setup for every user at once
+        batch_semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY_LIMIT)
+
+        async def summarize(user_id: str) -> str | None:
+            async with batch_semaphore:
+                return await self.summarize_user(user_id)
+
+        results = await asyncio.gather(
+            *(summarize(user_id) for user_id in unique_user_ids),
+            return_exceptions=True,
+        )
+        summaries: dict[str, str | None] = {}
+        for user_id, result in zip(unique_user_ids, results):
+            if isinstance(result, BaseException):
+                logger.warning(
+                    "Could not summarize user %s", user_id, exc_info=result
+                )
+                result = None
+            summaries[user_id] = result
+        return summaries
+
+    async def _retrieve_nodes(self, user_id: str) -> list[NodeWithScore]:
+        """
+        Retrieve the user's text and image nodes used to summarize them.
+
+        Args:
+            user_id (str): The user ID to retrieve the nodes for.
+
+        Returns:
+            list[NodeWithScore]: The retrieved text nodes followed by the image nodes.
+        """
+        # Initialize or get the user's index
         index = await self.vector_store.init_or_get_user_index(user_id=user_id)
-        text_qa_template_str = (
-            "Context information is below.\n"
-            "-----------------------------\n"
-            # f"{text_context_str}"
-            "Create a personality summary based on the users text data.\n"
-            "-----------------------------\n"
-            "Given the context information and no prior knowledge, "
-            "answer the query as in depth as you possibly can.\n"
-            "Query: {query_str}\n"
-            "Answer: "
+
+        # The retrieval query never changes, so its text and CLIP embeddings are
+        # computed once per process instead of costing an embedding round trip
+        # on every summary. Retrieval then is just the two vector searches.
+        if AIActions._retrieval_query_embeddings is None:
+            AIActions._retrieval_query_embeddings = await asyncio.gather(
+                index.service_context.embed_model.aget_query_embedding(
+                    self._RETRIEVAL_QUERY_STR
+                ),
+                index.image_embed_model.aget_query_embedding(
+                    self._RETRIEVAL_QUERY_STR
+                ),
+            )
+        text_embedding, image_embedding = AIActions._retrieval_query_embeddings
+
+        # All users share one collection, so only retrieve this user's nodes
+        filters = MetadataFilters(
+            filters=[
+                MetadataFilter(
+                    key="user_id",
+                    value=user_id,
+                ),
+            ],
         )
-        image_qa_template_str = (
-            "Context information is below.\n"
-            "-----------------------------\n"
-            "{context_str}"
-            "-----------------------------\n"
-            "Given the context information and no prior knowledge, "
-            "answer the query as in depth as you possibly can.\n"
-            "Query: {query_str}\n"
-            "Answer: "
+        text_nodes, image_nodes = await asyncio.gather(
+            self._search(index.vector_store, text_embedding, filters),
+            self._search(index.image_vector_store, image_embedding, filters),
         )
+        nodes = text_nodes + image_nodes
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Retrieved nodes for user %s: %s", user_id, nodes)
+        return nodes
+
+    async def _search(
+        self,
+        vector_store: BaseVectorStore,
+        query_embedding: list[float],
+        filters: MetadataFilters,
+    ) -> list[NodeWithScore]:
+        """
+        Search a vector store with a precomputed query embedding.
 
-        # qa_tmpl_text = PromptTemplate(text_qa_template_str)
-        qa_tmpl_image = PromptTemplate(image_qa_template_str)
-
-        # Create the Query Engine from the multimodal vector store index
-        # retriever = MultiModalVectorIndexRetriever(
-        #     index=index,
-        #     image_similarity_top_k=5,
-        #     similarity_top_k=5,
-        #     filters=MetadataFilters(
-        #         filters=[
-        #             MetadataFilter(
-        #                 key="user_id",
-        #                 value=user_id,
-        #             ),
-        #         ],
-        #     ),
-        # )
-        retriever = index.as_retriever(use_async=True)
-        image_nodes = await retriever.aretrieve(
-            "Find images provided by the user to create a summary of them."
+        Args:
+            vector_store (BaseVectorStore): The text or image vector store to search.
+            query_embedding (list[float]): The query embedding, from the model matching the store.
+            filters (MetadataFilters): The filters restricting the search to the user.
+
+        Returns:
+            list[NodeWithScore]: The most similar nodes with their scores.
+        """
+        result = await vector_store.aquery(
+            VectorStoreQuery(
+                query_embedding=query_embedding,
+                similarity_top_k=self._SIMILARITY_TOP_K,
+                filters=filters,
+                # QdrantVectorStore drops the filters of a query that has
+                # neither doc_ids nor a query_str, so one must be set
+                query_str=self._RETRIEVAL_QUERY_STR,
+            )
         )
-        print(f"Image Nodes: {image_nodes}")
-        query_engine = SimpleMultiModalQueryEngine(
-            retriever=retriever,
-            multi_modal_llm=self._multi_modal_agent,
+        return [
+            NodeWithScore(node=node, score=score)
+            for node, score in zip(
+                result.nodes or [], result.similarities or []
+            )
+        ]
+
+    def _summary_cache_key(
+        self, user_id: str, nodes: list[NodeWithScore]
+    ) -> str:
+        """
+        Build the summary cache key for the user from the nodes the summary is generated from.
+        """
+        return summary_cache.make_key(
+            user_id,
+            [node.node_id for node in nodes],
+            self._multi_modal_agent.model,
         )
 
-        # Query the engine for each individual response to aggregate it into an overall response afterwards with additional context
-        query_str = "Analyze your knowledgebase of images for the user to create a summary of them."
-        ai_response = await query_engine.aquery(query_str)
+    def _build_prompt(
+        self, nodes: list[NodeWithScore]
+    ) -> tuple[str, list[ImageNode]]:
+        """
+        Split the retrieved nodes into text context and images and format the summary prompt.
 
-        # Finally get the response
-        response = str(ai_response)
-        # image_response = str(image_ai_response)
-        return response
+        Args:
+            nodes (list[NodeWithScore]): The nodes retrieved for the user.
+
+        Returns:
+            tuple[str, list[ImageNode]]: The formatted prompt and the image nodes to send alongside it.
+        """
+        image_documents = [
+            node.node for node in nodes if isinstance(node.node, ImageNode)
+        ]
+        context_str = "\n\n".join(
+            node.get_content()
+            for node in nodes
+            if not isinstance(node.node, ImageNode)
+        )
+        prompt = self._IMAGE_QA_TMPL.format(
+            context_str=context_str,
+            query_str=self._SUMMARY_QUERY_STR,
+        )
+        return prompt, image_documents
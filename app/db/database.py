@@ -6,7 +6,6 @@ from mimetypes import guess_extension
 
 # The Vector DB Import
 from typing import Any
-from app.utils.image_utils import get_image_filename, image_to_inputfile
 
 # Local Imports
 from app.models.models import (
@@ -23,12 +22,15 @@ from app.utils.image_utils import (
 )
 
 # System Imports
+import logging
 import os
 from dotenv import load_dotenv
 import base64
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 APPWRITE_API_KEY = os.getenv("APPWRITE_API_KEY")
 APPWRITE_ENDPOINT = os.getenv("APPWRITE_ENDPOINT")
 APPWRITE_PROJECT_ID = os.getenv("APPWRITE_PROJECT_ID")
@@ -54,17 +56,17 @@ class Database:
         """
         Initialize the Database class and the connections to Appwrite.
         """
-        print("Connected to Database")
+        logger.debug("Connected to Database")
 
     async def async_init(self, user_id: str):
         """
         Asynchronous initializer for the Database Connection
         """
         try:
-            print("Initialized asynchronously")
+            logger.debug("Initialized asynchronously")
         except Exception as e:
-            print(
+            logger.error(
                 "Failed to initialize database connection for user: %s", user_id
             )
-            print("Error: %s", str(e))
+            logger.error("Error: %s", str(e))
             raise e
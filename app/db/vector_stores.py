@@ -6,39 +6,63 @@ The VectorStore class is a singleton, meaning there can only be one instance of
 
 # External Libraries
 from llama_index.indices.multi_modal.base import MultiModalVectorStoreIndex
-from llama_index.vector_stores import QdrantVectorStore, SimpleVectorStore
-from llama_index import SimpleDirectoryReader, StorageContext
-from llama_index.llms import OpenAI
-from llama_index.multi_modal_llms import OpenAIMultiModal
-from llama_index.prompts import PromptTemplate
-from llama_index.query_engine import SimpleMultiModalQueryEngine
+from llama_index.vector_stores import QdrantVectorStore
 from llama_index import Document
-from llama_index.schema import ImageDocument, ImageNode
-from PIL import Image
-import aiohttp
-import qdrant_client
+from llama_index.ingestion import run_transformations
+from llama_index.schema import (
+    ImageDocument,
+    NodeRelationship,
+    RelatedNodeInfo,
+    TextNode,
+)
 from qdrant_client import AsyncQdrantClient, QdrantClient
-import openai
+from qdrant_client.models import (
+    Distance,
+    HnswConfigDiff,
+    PayloadSchemaType,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+    VectorParamsDiff,
+)
 from dotenv import load_dotenv
-import tempfile
 
 # Default Python Libraries
-from io import BytesIO
-import base64
+from collections import OrderedDict
+import asyncio
+import logging
 import os
+import uuid
 
 # Local Libraries
-# from app.ai_actions import AIActions
+from app.db.embeddings import BatchedClipEmbedding
 from app.models.models import ImageIngestionRequest
-from app.utils.image_utils import (
-    fetch_image_from_url,
-    pil_image_to_base64,
-    image_req_to_base64,
-)
+from app.utils.image_utils import image_req_to_base64
+from app.utils.response_cache import summary_cache
 
 load_dotenv()
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
+
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost")
+# gRPC sends points as protobuf instead of JSON, which matters for base64 image payloads
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+KNOWN_USERS_MAXSIZE = int(os.getenv("KNOWN_USERS_MAXSIZE", "1024"))
+
+# All users share these collections and are separated by the user_id payload
+TEXT_COLLECTION_NAME = "global_text_store"
+IMAGE_COLLECTION_NAME = "global_image_store"
+# Dimensions of the index's default OpenAI text and CLIP ViT-B/32 embeddings
+TEXT_VECTOR_SIZE = int(os.getenv("TEXT_VECTOR_SIZE", "1536"))
+IMAGE_VECTOR_SIZE = int(os.getenv("IMAGE_VECTOR_SIZE", "512"))
+# HNSW graph parameters used when creating the shared collections
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCT = int(os.getenv("HNSW_EF_CONSTRUCT", "200"))
+# Keep int8 copies of the vectors in RAM for search and move the float32 originals to disk,
+# where they are only read for rescoring; vector RAM drops to about a quarter
+SCALAR_QUANTIZATION = os.getenv("SCALAR_QUANTIZATION", "true").lower() == "true"
 
 
 class VectorStore:
@@ -47,47 +71,180 @@ class VectorStore:
     It uses the Qdrant client to create and manage collections of text and image data for each user.
     """
 
-    _qdrant_client = QdrantClient(url="http://localhost")
+    _qdrant_client: QdrantClient | None = None
     _qdrant_client_async: AsyncQdrantClient | None = None
     _text_store: QdrantVectorStore | None = None
     _image_store: QdrantVectorStore | None = None
     _index: MultiModalVectorStoreIndex | None = None
-    _agent = OpenAI(
-        model="gpt-4-1106-preview",
-        temperature=0.0,
-    )
-    _multi_modal_agent = OpenAIMultiModal(
-        model="gpt-4-vision-preview",
-        temperature=0.0,
-    )
+    _instance: "VectorStore | None" = None
+    _init_lock = asyncio.Lock()
+    _known_users: OrderedDict[str, None] = OrderedDict()
+    _user_locks: dict[str, asyncio.Lock] = {}
 
     @classmethod
     async def get_instance(cls):
         """
         Get the instance of the VectorStore class. If it doesn't exist, create a new one.
+        The instance, Qdrant clients, stores and index are shared by the whole process and only created once,
+        so after startup this is an attribute lookup.
         """
-        self = cls()
-        if cls._qdrant_client_async is None:
-            cls._qdrant_client_async = AsyncQdrantClient(url="http://localhost")
-        if cls._text_store is None or cls._image_store is None:
-            cls._text_store = QdrantVectorStore(
-                "global_text_store",
-                client=cls._qdrant_client,
-                aclient=cls._qdrant_client_async,
-            )
-            cls._image_store = QdrantVectorStore(
-                "global_image_store",
-                client=cls._qdrant_client,
-                aclient=cls._qdrant_client_async,
-            )
-        if cls._index is None:
-            cls._index = MultiModalVectorStoreIndex.from_vector_store(
-                vector_store=cls._text_store,
-                image_vector_store=cls._image_store,
-                use_async=True,
-                show_progress=True,
+        if cls._instance is not None:
+            return cls._instance
+        async with cls._init_lock:
+            if cls._instance is None:
+                await cls._init_shared()
+                cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    async def _init_shared(cls):
+        """
+        Create the process-wide Qdrant clients, vector stores and index.
+        Must be called while holding _init_lock.
+        """
+        cls._qdrant_client = QdrantClient(
+            url=QDRANT_URL,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+        )
+        cls._qdrant_client_async = AsyncQdrantClient(
+            url=QDRANT_URL,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+        )
+        await cls._ensure_collection(TEXT_COLLECTION_NAME, TEXT_VECTOR_SIZE)
+        await cls._ensure_collection(IMAGE_COLLECTION_NAME, IMAGE_VECTOR_SIZE)
+        cls._text_store = QdrantVectorStore(
+            TEXT_COLLECTION_NAME,
+            client=cls._qdrant_client,
+            aclient=cls._qdrant_client_async,
+        )
+        cls._image_store = QdrantVectorStore(
+            IMAGE_COLLECTION_NAME,
+            client=cls._qdrant_client,
+            aclient=cls._qdrant_client_async,
+        )
+        cls._index = MultiModalVectorStoreIndex.from_vector_store(
+            vector_store=cls._text_store,
+            image_vector_store=cls._image_store,
+            image_embed_model=BatchedClipEmbedding(),
+        )
+
+    @classmethod
+    async def _ensure_collection(cls, collection_name: str, vector_size: int):
+        """
+        Create a shared collection if it doesn't exist yet, or bring an existing one up to the configured
+        HNSW and quantization settings, and index its user_id payload field so per-user filtered searches
+        use the payload index instead of scanning every point.
+
+        Args:
+            collection_name (str): The name of the collection.
+            vector_size (int): The dimension of the vectors stored in the collection.
+        """
+        aclient = cls._qdrant_client_async
+        if await cls._collection_exists(collection_name):
+            await cls._update_collection_config(collection_name)
+        else:
+            try:
+                await aclient.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=VectorParams(
+                        size=vector_size,
+                        distance=Distance.COSINE,
+                        # The int8 copies serve searches, so the originals only need to be on disk
+                        on_disk=SCALAR_QUANTIZATION,
+                    ),
+                    hnsw_config=HnswConfigDiff(
+                        m=HNSW_M,
+                        ef_construct=HNSW_EF_CONSTRUCT,
+                    ),
+                    quantization_config=cls._quantization_config(),
+                )
+            except Exception:
+                # Every worker runs this at startup, so another one may have created it first
+                if not await cls._collection_exists(collection_name):
+                    raise
+                logger.debug(
+                    "Collection %s was created concurrently", collection_name
+                )
+        await aclient.create_payload_index(
+            collection_name=collection_name,
+            field_name="user_id",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+
+    @classmethod
+    async def _update_collection_config(cls, collection_name: str):
+        """
+        Apply the configured HNSW and quantization settings to an existing collection.
+        Collections created before these settings existed otherwise keep Qdrant's defaults.
+        Nothing is sent when the collection already matches, since an update makes Qdrant rebuild its index.
+
+        Args:
+            collection_name (str): The name of the collection.
+        """
+        aclient = cls._qdrant_client_async
+        config = (await aclient.get_collection(collection_name)).config
+        hnsw_config = None
+        if (
+            config.hnsw_config.m != HNSW_M
+            or config.hnsw_config.ef_construct != HNSW_EF_CONSTRUCT
+        ):
+            hnsw_config = HnswConfigDiff(
+                m=HNSW_M,
+                ef_construct=HNSW_EF_CONSTRUCT,
             )
-        return self
+        quantization_config = None
+        vectors_config = None
+        if SCALAR_QUANTIZATION:
+            if config.quantization_config is None:
+                quantization_config = cls._quantization_config()
+            vectors = config.params.vectors
+            if isinstance(vectors, VectorParams) and not vectors.on_disk:
+                # "" is the collection's unnamed vector
+                vectors_config = {"": VectorParamsDiff(on_disk=True)}
+        if not (hnsw_config or quantization_config or vectors_config):
+            return
+        logger.info(
+            "Updating the configuration of collection %s", collection_name
+        )
+        await aclient.update_collection(
+            collection_name=collection_name,
+            vectors_config=vectors_config,
+            hnsw_config=hnsw_config,
+            quantization_config=quantization_config,
+        )
+
+    @staticmethod
+    def _quantization_config() -> ScalarQuantization | None:
+        """
+        The quantization of the shared collections: int8 copies of the vectors kept in RAM, if enabled.
+        """
+        if not SCALAR_QUANTIZATION:
+            return None
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            ),
+        )
+
+    @classmethod
+    async def _collection_exists(cls, collection_name: str) -> bool:
+        """
+        Check whether a collection exists.
+
+        Args:
+            collection_name (str): The name of the collection.
+
+        Returns:
+            bool: Whether the collection exists.
+        """
+        collections = (
+            await cls._qdrant_client_async.get_collections()
+        ).collections
+        return collection_name in {c.name for c in collections}
 
     def __init__(self):
         """
@@ -103,22 +260,69 @@ class VectorStore:
         """
         Initialize or get the text and image collections as an index for the specified user.
 
+        The global user document is upserted under an ID derived from the user ID, so writing it again
+        (from another worker, after a restart or after an LRU eviction) replaces it instead of adding a duplicate.
+        Users whose document this process has written are kept in a bounded LRU so later calls are a dictionary lookup.
+
         Args:
             user_id (str): The user ID to initialize the index for.
+            has_text_store (bool): Whether the user's global document already exists.
 
         Returns:
             MultiModalVectorStoreIndex: The initialized or retrieved index.
         """
-        if not has_text_store:
-            print("Inserting global user document for new collection")
-            self._index.insert(
-                Document(
-                    doc_id=f"{user_id}",
-                    text=f"{user_id} is the users global Appwrite User ID",
+        if user_id in self._known_users:
+            self._known_users.move_to_end(user_id)
+            return self._index
+        if has_text_store:
+            self._remember_user(user_id)
+            return self._index
+        # One lock per user so concurrent first requests insert the document once
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            if user_id not in self._known_users:
+                logger.debug("Upserting global user document for %s", user_id)
+                await asyncio.to_thread(
+                    self._index.insert_nodes, [self._user_node(user_id)]
                 )
-            )
+                self._remember_user(user_id)
+        self._user_locks.pop(user_id, None)
         return self._index
 
+    @staticmethod
+    def _user_node(user_id: str) -> TextNode:
+        """
+        Create the global user document's node, with a point ID that is the same every time for the user.
+
+        Args:
+            user_id (str): The user ID the document describes.
+
+        Returns:
+            TextNode: The node to upsert.
+        """
+        return TextNode(
+            id_=str(uuid.uuid5(uuid.NAMESPACE_URL, f"user:{user_id}")),
+            text=f"{user_id} is the users global Appwrite User ID",
+            metadata={
+                "user_id": user_id,
+            },
+            relationships={
+                NodeRelationship.SOURCE: RelatedNodeInfo(node_id=user_id),
+            },
+        )
+
+    def _remember_user(self, user_id: str) -> None:
+        """
+        Mark a user as initialized, evicting the least recently used user if the cache is full.
+
+        Args:
+            user_id (str): The user ID to remember.
+        """
+        self._known_users[user_id] = None
+        self._known_users.move_to_end(user_id)
+        while len(self._known_users) > KNOWN_USERS_MAXSIZE:
+            self._known_users.popitem(last=False)
+
     async def ingest_text(self, user_id: str, text_id: str, text: str) -> None:
         """
         Ingest text into the index of the specified user for later use in summarization.
@@ -137,26 +341,172 @@ class VectorStore:
                 "user_id": user_id,
             },
         )
-        index.insert(document=document)
+        # Embedding and upserting block, so keep them off the event loop
+        await asyncio.to_thread(index.insert, document)
+        summary_cache.invalidate(user_id)
+
+    async def ingest_text_batch(
+        self, items: list[tuple[str, str, str]]
+    ) -> None:
+        """
+        Ingest several texts at once. All documents are inserted in a single call, so their embeddings are
+        requested in batches (up to the embedding model's embed_batch_size per request) and upserted to Qdrant
+        in batches instead of one round trip per text.
+
+        Args:
+            items (list[tuple[str, str, str]]): The (user_id, text_id, text) of each text to ingest.
+        """
+        if not items:
+            return
+        user_ids = list(dict.fromkeys(user_id for user_id, _, _ in items))
+        for user_id in user_ids:
+            await self.init_or_get_user_index(user_id=user_id)
+        documents = [
+            Document(
+                doc_id=f"{user_id}_{text_id}",
+                text=text,
+                metadata={
+                    "user_id": user_id,
+                },
+            )
+            for user_id, text_id, text in items
+        ]
+        await self._insert_documents(documents, user_ids)
 
     async def ingest_image(
         self,
         image_request: ImageIngestionRequest,
         image_id: str,
+        image_data: bytes | None = None,
     ) -> None:
         """
-        Asynchronously ingest an image (by URL) into the index of the specified user for later use in summarization.
+        Asynchronously ingest an image into the index of the specified user for later use in summarization.
 
         Args:
-            user_id (str): The user ID to initialize the index for.
+            image_request (ImageIngestionRequest): The request describing the image to be ingested.
             image_id (str): The unique identifier for the image.
-            image_url (str | None): The URL of the image to be ingested.
-            image_data (str | None): The Base64 encoded image to be ingested.
+            image_data (bytes | None): The already resolved Base64 encoded image, if the caller fetched it.
+
+        Raises:
+            ValueError: If the image could not be fetched or decoded.
         """
-        image_data = await image_req_to_base64(image_request)
+        if image_data is None:
+            image_data = await image_req_to_base64(image_request)
+        if image_data is None:
+            raise ValueError("Image could not be fetched or decoded")
         index = await self.init_or_get_user_index(user_id=image_request.userId)
-        # Create the image document
-        image_doc = ImageDocument(
+        image_doc = self._image_document(image_request, image_id, image_data)
+        # insert the node off the event loop
+        await asyncio.to_thread(index.insert, image_doc)
+        summary_cache.invalidate(image_request.userId)
+
+    async def ingest_image_batch(
+        self, items: list[tuple[ImageIngestionRequest, str]]
+    ) -> list[int]:
+        """
+        Ingest several images at once. The images are fetched concurrently and inserted in a single call,
+        so CLIP embeds them in batches of its embed_batch_size per forward pass instead of one at a time.
+        Any text attached to an image is stored with the image document and, like a single image's text,
+        ingested into the text collection under the image's ID.
+
+        Args:
+            items (list[tuple[ImageIngestionRequest, str]]): The request and unique identifier of each image to ingest.
+
+        Returns:
+            list[int]: The positions in items of the images that could not be fetched or decoded and were skipped.
+        """
+        if not items:
+            return []
+        # One bad URL or image must not fail the rest of the batch
+        results = await asyncio.gather(
+            *(image_req_to_base64(image_request) for image_request, _ in items),
+            return_exceptions=True,
+        )
+        images_data: list[bytes | None] = []
+        for position, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logger.warning(
+                    "Could not fetch image %d (%s) of the batch",
+                    position,
+                    items[position][0].image_url,
+                    exc_info=result,
+                )
+                result = None
+            images_data.append(result)
+        failed = [
+            position
+            for position, image_data in enumerate(images_data)
+            if image_data is None
+        ]
+        ingested = [
+            (image_request, image_id, image_data)
+            for (image_request, image_id), image_data in zip(items, images_data)
+            if image_data is not None
+        ]
+        if not ingested:
+            return failed
+        user_ids = list(
+            dict.fromkeys(request.userId for request, _, _ in ingested)
+        )
+        for user_id in user_ids:
+            await self.init_or_get_user_index(user_id=user_id)
+        documents = [
+            self._image_document(image_request, image_id, image_data)
+            for image_request, image_id, image_data in ingested
+        ]
+        texts = [
+            (image_request.userId, image_id, image_request.text_request.text)
+            for image_request, image_id, _ in ingested
+            if image_request.text_request is not None
+        ]
+        await asyncio.gather(
+            self._insert_documents(documents, user_ids),
+            self.ingest_text_batch(texts),
+        )
+        return failed
+
+    async def _insert_documents(
+        self, documents: list[Document], user_ids: list[str]
+    ) -> None:
+        """
+        Insert several documents into the index in one call and invalidate the cached summaries of their users.
+        Embedding and upserting block, so the insert runs in a worker thread.
+
+        Args:
+            documents (list[Document]): The documents to insert.
+            user_ids (list[str]): The users the documents belong to.
+        """
+        await asyncio.to_thread(self._index_documents, documents)
+        for user_id in user_ids:
+            summary_cache.invalidate(user_id)
+
+    def _index_documents(self, documents: list[Document]) -> None:
+        """
+        Split, embed and upsert documents into the index. Blocks until the vector store has them.
+
+        Args:
+            documents (list[Document]): The documents to insert.
+        """
+        index = self._index
+        nodes = run_transformations(
+            documents, index.service_context.transformations
+        )
+        index.insert_nodes(nodes)
+        for document in documents:
+            index.docstore.set_document_hash(
+                document.get_doc_id(), document.hash
+            )
+
+    @staticmethod
+    def _image_document(
+        image_request: ImageIngestionRequest,
+        image_id: str,
+        image_data: bytes | None,
+    ) -> ImageDocument:
+        """
+        Create the image document stored for an image ingestion request.
+        """
+        return ImageDocument(
             doc_id=f"{image_id}",
             image=image_data,
             metadata={
@@ -167,5 +517,3 @@ class VectorStore:
             else "",
             image_mimetype=image_request.mimetype,
         )
-        # insert the node
-        index.insert(image_doc)
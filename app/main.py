@@ -1,8 +1,7 @@
-from uvicorn import Config, Server as UvicornServer
-from app.server import Server
+# The app is declared at import in app.server; the entrypoint serves app.main:app
+from app.server import app
 
 
 def start():
     print("Running Server")
-    app = Server().app
     return app
@@ -3,15 +3,34 @@ This module contains the models used in the application. These models are used t
 """
 
 # External Libraries
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Extra, Field
 from datetime import datetime
+import msgspec
 
 # Python Standard Libraries
-from typing import Any
+from typing import Annotated, Any
 from enum import Enum
+import time
 
 
-class ServerResponse(BaseModel):
+class AppModel(BaseModel):
+    """
+    This class is the base of every Pydantic model in the application. It spells out the model configuration so no model pays for features it doesn't use.
+    Flat request and response bodies that need no Pydantic features are msgspec Structs instead, decoded by the server without Pydantic.
+    """
+
+    class Config:
+        # Unknown fields are dropped rather than stored on the model
+        extra = Extra.ignore
+        # Aliased fields (e.g. "$id") can also be populated by their field name
+        allow_population_by_field_name = True
+        validate_assignment = False
+        use_enum_values = True
+        # Nested models are used as validated instead of being copied again
+        copy_on_model_validation = "none"
+
+
+class ServerResponse(AppModel):
     """
     This class represents the structure of a server response. It contains a status code, a message, and any data that the server might return.
     """
@@ -30,18 +49,17 @@ class ServerResponse(BaseModel):
     )
 
 
-class UserRequest(BaseModel):
+class UserRequest(msgspec.Struct):
     """
     This class represents a request for a user. It contains the user's unique identifier.
     """
 
-    userId: str = Field(
-        default="",
-        description="The unique identifier for the user.",
-    )
+    userId: Annotated[
+        str, msgspec.Meta(description="The unique identifier for the user.")
+    ] = ""
 
 
-class TextIngestion(BaseModel):
+class TextIngestion(AppModel):
     """
     This class represents a text ingestion. It contains the unique identifier for the text ingestion, the time it was created and updated, the user's unique identifier, the text to be ingested, the source of the text, the time the text source was created, the language of the text, whether the text was created by the user, and the unique identifier for any associated image.
     """
@@ -52,12 +70,12 @@ class TextIngestion(BaseModel):
         description="The unique identifier for the text ingestion.",
     )
     createdAt: str = Field(
-        default=datetime.now().isoformat(),
+        default_factory=lambda: datetime.now().isoformat(),
         alias="$createdAt",
         description="The time when the text ingestion was created.",
     )
     updatedAt: str = Field(
-        default=datetime.now().isoformat(),
+        default_factory=lambda: datetime.now().isoformat(),
         alias="$updatedAt",
         description="The time when the text ingestion was updated.",
     )
@@ -74,7 +92,7 @@ class TextIngestion(BaseModel):
         description="The source of the text.",
     )
     sourceTimestamp: float = Field(
-        default=datetime.now().timestamp(),
+        default_factory=time.time,
         description="The time when the text source was created (e.g. time of posting on Twitter).",
     )
     language: str = Field(
@@ -91,7 +109,7 @@ class TextIngestion(BaseModel):
     )
 
 
-class TextIngestionRequest(BaseModel):
+class TextIngestionRequest(AppModel):
     """
     This class represents a request for a text ingestion. It contains the user's unique identifier, the text to be ingested, the source of the text, the time the text source was created, the language of the text, whether the text was created by the user, and the unique identifier for any associated image.
     """
@@ -109,7 +127,7 @@ class TextIngestionRequest(BaseModel):
         description="The source of the text.",
     )
     source_timestamp: float = Field(
-        default=datetime.now().timestamp(),
+        default_factory=time.time,
         description="The time when the text source was created (e.g. time of posting on Twitter).",
     )
     language: str = Field(
@@ -126,7 +144,18 @@ class TextIngestionRequest(BaseModel):
     )
 
 
-class ImageIngestionRequest(BaseModel):
+class BatchTextIngestionRequest(AppModel):
+    """
+    This class represents a request for several text ingestions at once. It contains the text ingestion requests.
+    """
+
+    texts: list[TextIngestionRequest] = Field(
+        default=[],
+        description="The texts to be ingested.",
+    )
+
+
+class ImageIngestionRequest(AppModel):
     """
     This class represents a request for an image ingestion. It contains the user's unique identifier, the image to be ingested as a direct URL or in base64 encoded format, the mimetype of the image, and any text to be ingested.
     """
@@ -139,7 +168,7 @@ class ImageIngestionRequest(BaseModel):
         default="",
         description="The image to be ingested as a direct URL to the image.",
     )
-    image: str | bytes | None = Field(
+    image: str | None = Field(
         default="",
         description="The image to be ingested in base64 encoded format.",
     )
@@ -153,30 +182,50 @@ class ImageIngestionRequest(BaseModel):
     )
 
 
-class AssessmentRequest(BaseModel):
+class BatchImageIngestionRequest(AppModel):
     """
-    This class represents a request for an assessment. It contains the user's unique identifier.
+    This class represents a request for several image ingestions at once. It contains the image ingestion requests.
     """
 
-    userId: str = Field(
-        default="",
-        description="The unique identifier for the user.",
+    images: list[ImageIngestionRequest] = Field(
+        default=[],
+        description="The images to be ingested.",
     )
 
 
-class AssessmentResponse(BaseModel):
+class AssessmentRequest(msgspec.Struct):
+    """
+    This class represents a request for an assessment. It contains the user's unique identifier.
+    """
+
+    userId: Annotated[
+        str, msgspec.Meta(description="The unique identifier for the user.")
+    ] = ""
+
+
+class BatchAssessmentRequest(msgspec.Struct):
+    """
+    This class represents a request for assessments of several users at once. It contains the users' unique identifiers.
+    """
+
+    userIds: Annotated[
+        list[str],
+        msgspec.Meta(description="The unique identifiers for the users."),
+    ] = []
+
+
+class AssessmentResponse(msgspec.Struct):
     """
     This class represents a response for an assessment. It contains the user's unique identifier, the assessment's unique identifier, the assessment's score, and the assessment's label.
     """
 
-    userId: str = Field(
-        default="",
-        description="The unique identifier for the user.",
-    )
-    assessmentId: str = Field(
-        default="",
-        description="The unique identifier for the assessment.",
-    )
-    assessmentConfidence: float = Field(
-        default=0.0, description="The confidence of the assessment."
-    )
+    userId: Annotated[
+        str, msgspec.Meta(description="The unique identifier for the user.")
+    ] = ""
+    assessmentId: Annotated[
+        str,
+        msgspec.Meta(description="The unique identifier for the assessment."),
+    ] = ""
+    assessmentConfidence: Annotated[
+        float, msgspec.Meta(description="The confidence of the assessment.")
+    ] = 0.0
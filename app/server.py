@@ -1,18 +1,26 @@
 # External Libraries
-import math
-import random
-from fastapi import FastAPI, APIRouter
+from fastapi import Depends, FastAPI, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import msgspec
 import openai
 from dotenv import load_dotenv
+from pydantic.error_wrappers import ErrorWrapper
 
 # Python Standard Libraries
+from typing import AsyncIterator, Awaitable, Callable
+import asyncio
+import logging
 import os
-import nest_asyncio
+import uuid
 
 # Local Libraries
 from app.models.models import (
     AssessmentRequest,
+    BatchAssessmentRequest,
+    BatchImageIngestionRequest,
+    BatchTextIngestionRequest,
     ServerResponse,
     TextIngestionRequest,
     ImageIngestionRequest,
@@ -22,186 +30,376 @@ from app.api.ai_actions import AIActions
 from app.db.database import Database
 from app.db.vector_stores import VectorStore
 
-from app.utils.image_utils import fetch_image_from_url, image_req_to_base64
+from app.utils.image_utils import (
+    close_session,
+    get_session,
+    image_req_to_base64,
+)
 
 
 # Load environment variables
 load_dotenv()
 
-# Set OpenAI API Key
+logger = logging.getLogger(__name__)
+
+# Set OpenAI API Key; like every setting it is read from the environment once, at import
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai.api_key = OPENAI_API_KEY
 
 # Define allowed origins for CORS
 origins = ["http://localhost:4321"]
 
-nest_asyncio.apply()
+
+async def to_event_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Frame text chunks as server-sent events, ending the stream with a done event, or with an error event
+    if the chunks could not all be generated.
+    """
+    try:
+        async for chunk in chunks:
+            yield format_event(chunk)
+    except Exception as e:
+        logger.exception("Error streaming summary")
+        yield format_event(f"Error generating summary: {str(e)}", "error")
+        return
+    yield "event: done\ndata: \n\n"
 
 
-# Server class definition
-class Server:
+def format_event(data: str, event: str | None = None) -> str:
     """
-    This class is responsible for managing the server and its routes.
+    Format data as a server-sent event, splitting it over data lines so it may contain newlines.
     """
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return (f"event: {event}\n" if event else "") + lines + "\n"
+
+
+def decode_body(
+    struct_type: type[msgspec.Struct],
+) -> Callable[[Request], Awaitable[msgspec.Struct]]:
+    """
+    Create a FastAPI dependency that decodes a JSON request body straight into a msgspec Struct.
+
+    Args:
+        struct_type (type[msgspec.Struct]): The Struct the body is decoded into.
+
+    Returns:
+        Callable[[Request], Awaitable[msgspec.Struct]]: The dependency, to be used with Depends.
+    """
+    decoder = msgspec.json.Decoder(struct_type)
+
+    async def decode(request: Request) -> msgspec.Struct:
+        try:
+            return decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            # Same 422 body as FastAPI's own validation errors on the Pydantic routes
+            raise RequestValidationError(
+                [ErrorWrapper(ValueError(str(e)), loc=("body",))]
+            )
+
+    return decode
+
+
+def request_body(struct_type: type[msgspec.Struct]) -> dict:
+    """
+    Describe a msgspec Struct request body for the OpenAPI schema, since bodies read through decode_body
+    are invisible to FastAPI. The Struct's schema is inlined, so it should not nest other Structs.
+
+    Args:
+        struct_type (type[msgspec.Struct]): The Struct the body is decoded into.
+
+    Returns:
+        dict: The value for the route's openapi_extra.
+    """
+    _, components = msgspec.json.schema_components((struct_type,))
+    return {
+        "requestBody": {
+            "content": {
+                "application/json": {"schema": components[struct_type.__name__]}
+            },
+            "required": True,
+        }
+    }
+
+
+# Responses are encoded with orjson instead of the stdlib json module.
+# Routes set response_model=None so returned models are serialized as they
+# are, without FastAPI validating them a second time on the way out.
+# The app and its routes are declared once at import, so every worker forked
+# from a preloaded app shares the same route table.
+app = FastAPI(default_response_class=ORJSONResponse)
+# CORSMiddleware is plain ASGI middleware; keep any added later the same
+# rather than BaseHTTPMiddleware, which wraps every request a second time
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.on_event("startup")
+async def startup_event():
+    # Fail at startup rather than on the first summary request
+    if not OPENAI_API_KEY:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+    logger.info("Initializing Vector Database")
+    await VectorStore.get_instance()
+    await AIActions.init()
+    await get_session()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await AIActions.close()
+    await close_session()
 
-    def __init__(self):
-        self.app = FastAPI()
-        self.app.add_middleware(
-            CORSMiddleware,
-            allow_origins=origins,
-            allow_credentials=True,
-            allow_methods=["*"],
-            allow_headers=["*"],
-        )
 
-        @self.app.on_event("startup")
-        async def startup_event():
-            print("Initializing Vector Database")
-            await VectorStore.get_instance()
+@app.get("/")
+async def heartbeat() -> ORJSONResponse:
+    """
+    A simple route to check the server status.
+    """
+    return ORJSONResponse({"status": "alive"})
+
 
-        self.router = APIRouter()
-        self.router.add_api_route(
-            "/",
-            self.heartbeat,
-            methods=["GET"],
+@app.post(
+    "/add_text_source",
+    response_model=None,
+)
+async def ingest_text(
+    text: TextIngestionRequest,
+) -> ServerResponse:
+    """
+    This route is used to ingest and store text data.
+    """
+    try:
+        vectordb = await VectorStore.get_instance()
+        await vectordb.ingest_text(
+            text.userId,
+            uuid.uuid4().hex,
+            text.text,
         )
-        self.router.add_api_route(
-            "/add_text_source",
-            self.ingest_text,
-            methods=["POST"],
-            response_model_exclude_none=True,
-            response_model_exclude_unset=True,
+        return ServerResponse(
+            status=200,
+            message="Text Ingested",
+            data=None,
         )
-        self.router.add_api_route(
-            "/add_image_and_maybe_text_source",
-            self.ingest_image_and_maybe_text,
-            methods=["POST"],
-            response_model_exclude_none=True,
-            response_model_exclude_unset=True,
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error ingesting text: {str(e)}",
+            data=None,
         )
-        self.router.add_api_route(
-            "/summarize_profile",
-            self.get_summary,
-            methods=["POST"],
-            response_model_exclude_none=True,
-            response_model_exclude_unset=True,
+
+
+@app.post(
+    "/add_text_sources",
+    response_model=None,
+)
+async def ingest_texts(
+    texts: BatchTextIngestionRequest,
+) -> ServerResponse:
+    """
+    This route is used to ingest and store several texts in one batch.
+    """
+    try:
+        vectordb = await VectorStore.get_instance()
+        await vectordb.ingest_text_batch(
+            [
+                (
+                    text.userId,
+                    uuid.uuid4().hex,
+                    text.text,
+                )
+                for text in texts.texts
+            ]
         )
-        self.app.include_router(self.router)
-
-    async def heartbeat(self):
-        """
-        A simple route to check the server status.
-        """
-        return {"status": "alive"}
-
-    async def ingest_text(
-        self,
-        text: TextIngestionRequest,
-    ) -> ServerResponse:
-        """
-        This method is used to ingest and store text data.
-        """
-        try:
-            vectordb = await VectorStore.get_instance()
-            await vectordb.ingest_text(
-                text.userId,
-                random.random() * 1000000000000000,
-                text.text,
-            )
+        return ServerResponse(
+            status=200,
+            message="Texts Ingested",
+            data=None,
+        )
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error ingesting texts: {str(e)}",
+            data=None,
+        )
+
+
+@app.post(
+    "/add_image_and_maybe_text_source",
+    response_model=None,
+)
+async def ingest_image_and_maybe_text(
+    image_request: ImageIngestionRequest,
+) -> ServerResponse:
+    """
+    This route is used to ingest and store image data and optionally text data.
+    """
+    try:
+        if not image_request.image_url and not image_request.image:
             return ServerResponse(
-                status=200,
-                message="Text Ingested",
+                status=400,
+                message="No image or image URL provided",
                 data=None,
             )
-        except Exception as e:
+        # Resolve the image first so no text is stored for an image that cannot be fetched
+        image_data = await image_req_to_base64(image_request)
+        if image_data is None:
             return ServerResponse(
-                status=500,
-                message=f"Error ingesting text: {str(e)}",
+                status=400,
+                message="Image could not be fetched or decoded",
                 data=None,
             )
-
-    async def ingest_image_and_maybe_text(
-        self,
-        image_request: ImageIngestionRequest,
-    ) -> ServerResponse:
-        """
-        This method is used to ingest and store image data and optionally text data.
-        """
-        try:
-            vectordb = await VectorStore.get_instance()
-            if (
-                image_request.image_url is not None
-                and len(image_request.image_url) > 0
-            ):
-                image_request.image = await fetch_image_from_url(
-                    image_request.image_url
-                )
-                if image_request.text_request is not None:
-                    await vectordb.ingest_text(
-                        image_request.userId,
-                        text_id=document_id,  # type: ignore
-                        text=image_request.text_request.text,  # type: ignore
-                    )
-                await vectordb.ingest_image(
-                    image_request=image_request,
-                    image_id=random.random() * 1000000000000000,
-                )
-                return ServerResponse(
-                    status=200,
-                    message="Image and Text (if provided) Ingested",
-                    data=None,
-                )
-            elif image_request.image is not None:
-                image_id = math.floor(random.random() * 1000000000000000)
-                if image_request.text_request is not None:
-                    await vectordb.ingest_text(
-                        image_request.userId,
-                        text_id=image_id,  # type: ignore
-                        text=image_request.text_request.text,  # type: ignore
-                    )
-                await vectordb.ingest_image(
-                    image_request=image_request,
-                    image_id=image_id,
-                )
-                return ServerResponse(
-                    status=200,
-                    message="Image and Text (if provided) Ingested",
-                    data=None,
-                )
-            else:
-                return ServerResponse(
-                    status=400,
-                    message="No image or image URL provided",
-                    data=None,
+        vectordb = await VectorStore.get_instance()
+        # The text shares the image's ID
+        image_id = uuid.uuid4().hex
+        ingestions = [
+            vectordb.ingest_image(
+                image_request=image_request,
+                image_id=image_id,
+                image_data=image_data,
+            )
+        ]
+        if image_request.text_request is not None:
+            ingestions.append(
+                vectordb.ingest_text(
+                    image_request.userId,
+                    text_id=image_id,
+                    text=image_request.text_request.text,  # type: ignore
                 )
-        except Exception as e:
-            return ServerResponse(
-                status=500,
-                message=f"Error ingesting image and/or text: {str(e)}",
-                data=None,
             )
+        # The text and image are independent, so ingest them concurrently
+        await asyncio.gather(*ingestions)
+        return ServerResponse(
+            status=200,
+            message="Image and Text (if provided) Ingested",
+            data=None,
+        )
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error ingesting image and/or text: {str(e)}",
+            data=None,
+        )
 
-    async def get_summary(
-        self,
-        assessment: AssessmentRequest,
-    ) -> ServerResponse:
-        """
-        This method is used to generate a summary of the user's data.
-        """
-        try:
-            print(f"Generating summary for user {assessment.userId}")
-            actions = await AIActions.get_instance()
-            print(f"Got AIActions instance for user {assessment.userId}")
-            summary = await actions.summarize_user(assessment.userId)
-            print(f"Generated summary for user {assessment.userId}")
+
+@app.post(
+    "/add_image_sources",
+    response_model=None,
+)
+async def ingest_images(
+    images: BatchImageIngestionRequest,
+) -> ServerResponse:
+    """
+    This route is used to ingest and store several images, and any text attached to them, in one batch.
+    """
+    try:
+        vectordb = await VectorStore.get_instance()
+        failed = await vectordb.ingest_image_batch(
+            [
+                (image_request, uuid.uuid4().hex)
+                for image_request in images.images
+            ]
+        )
+        if not failed:
             return ServerResponse(
                 status=200,
-                message="Summary Generated",
-                data=summary,
+                message="Images Ingested",
+                data=None,
             )
-        except Exception as e:
+        # Report the positions of the images that could not be fetched
+        if len(failed) == len(images.images):
             return ServerResponse(
-                status=500,
-                message=f"Error generating summary: {str(e)}",
-                data=None,
+                status=400,
+                message="No Images Could Be Fetched",
+                data={"failed": failed},
             )
+        return ServerResponse(
+            status=207,
+            message="Some Images Could Not Be Fetched",
+            data={"failed": failed},
+        )
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error ingesting images: {str(e)}",
+            data=None,
+        )
+
+
+@app.post(
+    "/summarize_profile",
+    response_model=None,
+    openapi_extra=request_body(AssessmentRequest),
+)
+async def get_summary(
+    assessment: AssessmentRequest = Depends(decode_body(AssessmentRequest)),
+) -> ServerResponse:
+    """
+    This route is used to generate a summary of the user's data.
+    """
+    try:
+        logger.debug("Generating summary for user %s", assessment.userId)
+        actions = await AIActions.get_instance()
+        summary = await actions.summarize_user(assessment.userId)
+        logger.debug("Generated summary for user %s", assessment.userId)
+        return ServerResponse(
+            status=200,
+            message="Summary Generated",
+            data=summary,
+        )
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error generating summary: {str(e)}",
+            data=None,
+        )
+
+
+@app.post(
+    "/summarize_profile/stream",
+    openapi_extra=request_body(AssessmentRequest),
+)
+async def stream_summary(
+    assessment: AssessmentRequest = Depends(decode_body(AssessmentRequest)),
+) -> StreamingResponse:
+    """
+    This route is used to stream a summary of the user's data as server-sent events while it is generated.
+    """
+    actions = await AIActions.get_instance()
+    return StreamingResponse(
+        to_event_stream(actions.stream_summary(assessment.userId)),
+        media_type="text/event-stream",
+    )
+
+
+@app.post(
+    "/summarize_profiles",
+    response_model=None,
+    openapi_extra=request_body(BatchAssessmentRequest),
+)
+async def get_summaries(
+    assessment: BatchAssessmentRequest = Depends(
+        decode_body(BatchAssessmentRequest)
+    ),
+) -> ServerResponse:
+    """
+    This route is used to generate summaries for several users at once.
+    """
+    try:
+        actions = await AIActions.get_instance()
+        summaries = await actions.summarize_users_batch(assessment.userIds)
+        return ServerResponse(
+            status=200,
+            message="Summaries Generated",
+            data=summaries,
+        )
+    except Exception as e:
+        return ServerResponse(
+            status=500,
+            message=f"Error generating summaries: {str(e)}",
+            data=None,
+        )
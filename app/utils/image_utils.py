@@ -2,12 +2,71 @@ from PIL import Image
 from appwrite.input_file import InputFile
 from io import BytesIO
 import aiohttp
-import base64
+import pybase64
 from mimetypes import guess_extension
-from datetime import datetime
+from functools import lru_cache
+import logging
+import os
+import struct
+import time
 
 from app.models.models import ImageIngestionRequest
 
+logger = logging.getLogger(__name__)
+
+# Images are stored no larger than this on either side; the vision model and CLIP downscale further anyway
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", "2048"))
+# Fetched images in these formats are stored without transcoding when they match the request's mimetype
+PASSTHROUGH_FORMATS = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/webp": "WEBP",
+}
+
+# Connection pool size and DNS cache lifetime (seconds) of the shared image fetch session
+IMAGE_FETCH_CONNECTION_LIMIT = int(
+    os.getenv("IMAGE_FETCH_CONNECTION_LIMIT", "100")
+)
+IMAGE_FETCH_DNS_TTL = int(os.getenv("IMAGE_FETCH_DNS_TTL", "300"))
+IMAGE_FETCH_CHUNK_SIZE = 64 * 1024
+# Largest image body (bytes) read from a URL; larger or over-long responses are rejected
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+
+# Start-of-frame markers of every JPEG coding process (DHT, JPG and DAC share the range)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Shared HTTP session so image fetches reuse pooled keep-alive connections
+_session: aiohttp.ClientSession | None = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Get the shared aiohttp session, creating it on first use.
+    The server creates it on startup, so requests normally only look it up.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=IMAGE_FETCH_CONNECTION_LIMIT,
+                ttl_dns_cache=IMAGE_FETCH_DNS_TTL,
+            )
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Close the shared aiohttp session if it was created.
+    """
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
 
 def image_to_inputfile(image: str, filename: str, mimetype: str) -> InputFile:
     """
@@ -21,7 +80,7 @@ def image_to_inputfile(image: str, filename: str, mimetype: str) -> InputFile:
     Returns:
         InputFile: The InputFile object created from the image.
     """
-    image_bytes = base64.b64decode(image)
+    image_bytes = pybase64.b64decode(image)
     return InputFile.from_bytes(
         bytes=image_bytes, filename=filename, mime_type=mimetype
     )
@@ -37,27 +96,127 @@ def pil_image_to_base64(image: Image.Image) -> str:
     Returns:
         str: The base64 encoded string of the image.
     """
+    return pybase64.b64encode(_encode_jpeg(image)).decode()
+
+
+def _encode_jpeg(image: Image.Image) -> bytes:
+    """
+    Encode a PIL Image object as JPEG, downscaling it to MAX_IMAGE_SIZE first.
+
+    Args:
+        image (Image.Image): The PIL Image object.
+
+    Returns:
+        bytes: The JPEG encoded image.
+    """
+    max_size = (MAX_IMAGE_SIZE, MAX_IMAGE_SIZE)
+    # For JPEGs this lets libjpeg decode straight to a reduced scale
+    image.draft("RGB", max_size)
+    image.thumbnail(max_size, Image.Resampling.BILINEAR)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
     image_buffer = BytesIO()
     image.save(image_buffer, format="JPEG")
-    return base64.b64encode(image_buffer.getvalue()).decode()
+    return image_buffer.getvalue()
+
+
+def sniff_image(image_data: bytes | bytearray) -> tuple[str, int, int] | None:
+    """
+    Read the format and dimensions of a JPEG, PNG or WebP image from its header bytes, without PIL.
+
+    Args:
+        image_data (bytes | bytearray): The encoded image.
+
+    Returns:
+        tuple[str, int, int] | None: The PIL format name, width and height, or None if the header isn't recognized.
+    """
+    try:
+        if (
+            image_data[:8] == b"\x89PNG\r\n\x1a\n"
+            and image_data[12:16] == b"IHDR"
+        ):
+            width, height = struct.unpack(">II", image_data[16:24])
+            return "PNG", width, height
+        if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+            chunk = image_data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", image_data[26:30])
+                return "WEBP", width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                (bits,) = struct.unpack("<I", image_data[21:25])
+                return "WEBP", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                width = int.from_bytes(image_data[24:27], "little") + 1
+                height = int.from_bytes(image_data[27:30], "little") + 1
+                return "WEBP", width, height
+            return None
+        if image_data[:3] == b"\xff\xd8\xff":
+            # Walk the segments up to the start-of-frame marker holding the dimensions
+            offset = 2
+            while offset + 9 <= len(image_data):
+                if image_data[offset] != 0xFF:
+                    return None
+                marker = image_data[offset + 1]
+                if marker == 0xFF:
+                    offset += 1
+                    continue
+                if marker in _JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(
+                        ">HH", image_data[offset + 5 : offset + 9]
+                    )
+                    return "JPEG", width, height
+                (length,) = struct.unpack(
+                    ">H", image_data[offset + 2 : offset + 4]
+                )
+                offset += 2 + length
+    except struct.error:
+        pass
+    return None
 
 
-async def fetch_image_from_url(image_url: str) -> bytes | None:
+async def fetch_image_from_url(image_url: str) -> bytearray | None:
     """
     Fetch an image from a given URL.
+    When the response states its length, the body is streamed into a buffer of that size
+    instead of being accumulated chunk by chunk. Bodies larger than MAX_IMAGE_BYTES, stated or
+    actually sent, are rejected.
 
     Args:
         image_url (str): The URL of the image.
 
     Returns:
-        bytes | None: The image data in bytes if successful, None otherwise.
+        bytearray | None: The image data in bytes if successful, None otherwise.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as response:
-            if response.status == 200:
-                image_data = await response.read()
-                return image_data
-    return None
+    session = await get_session()
+    async with session.get(image_url) as response:
+        if response.status != 200:
+            return None
+        content_length = response.content_length
+        # A compressed body is decoded while reading, so its length is unknown
+        if response.headers.get("Content-Encoding"):
+            content_length = None
+        if content_length is not None and content_length > MAX_IMAGE_BYTES:
+            logger.warning(
+                "Image at %s is too large (%d bytes)", image_url, content_length
+            )
+            return None
+        # The header is only trusted up to the cap; without it the buffer grows as chunks arrive
+        image_data = bytearray(content_length or 0)
+        offset = 0
+        async for chunk in response.content.iter_chunked(
+            IMAGE_FETCH_CHUNK_SIZE
+        ):
+            if offset + len(chunk) > MAX_IMAGE_BYTES:
+                logger.warning(
+                    "Image at %s is larger than %d bytes",
+                    image_url,
+                    MAX_IMAGE_BYTES,
+                )
+                return None
+            image_data[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+        del image_data[offset:]
+        return image_data
 
 
 async def image_req_to_base64(
@@ -72,21 +231,30 @@ async def image_req_to_base64(
     Returns:
         bytes | None: The base64 encoded string of the image if successful, None otherwise.
     """
-    if image_request.image_url is not None:
-        print(f"Image URL is not None")
+    # Images sent as base64 are already in the stored format, so skip any decoding
+    if image_request.image and not image_request.image_url:
+        return image_request.image.encode()
+    elif image_request.image_url:
+        logger.debug("Fetching image from %s", image_request.image_url)
         image_data = await fetch_image_from_url(image_request.image_url)
         if image_data is not None:
+            header = sniff_image(image_data)
+            if header is None:
+                # Opening only parses the header; pixels are decoded on demand
+                image = Image.open(BytesIO(image_data))
+                header = (image.format, *image.size)
+            image_format, width, height = header
+            if (
+                PASSTHROUGH_FORMATS.get(image_request.mimetype) == image_format
+                and max(width, height) <= MAX_IMAGE_SIZE
+            ):
+                # Already stored as-is, so skip the decode and re-encode
+                return pybase64.b64encode(image_data)
             image = Image.open(BytesIO(image_data))
-            return pil_image_to_base64(image).encode()
-    elif image_request.image is not None:
-        if isinstance(image_request.image, str):
-            print(f"Image is a string")
-            return image_request.image.encode()
-        else:
-            # This means it's Base64 Encoded
-            return image_request.image
-    else:
-        return None
+            # The image document takes its mimetype from the request
+            image_request.mimetype = "image/jpeg"
+            return pybase64.b64encode(_encode_jpeg(image))
+    return None
 
 
 def get_image_filename(image_request: ImageIngestionRequest) -> str:
@@ -99,8 +267,14 @@ def get_image_filename(image_request: ImageIngestionRequest) -> str:
     Returns:
         str: The filename of the image.
     """
-    file_extension = guess_extension(image_request.mimetype)
-    filename = (
-        f"{image_request.userId}_{datetime.now().timestamp()}{file_extension}"
-    )
+    file_extension = _extension_for(image_request.mimetype)
+    filename = f"{image_request.userId}_{time.time()}{file_extension}"
     return filename
+
+
+@lru_cache(maxsize=32)
+def _extension_for(mimetype: str) -> str:
+    """
+    Get the file extension for a mimetype. Only a handful of image mimetypes are ever seen, so the lookups are cached.
+    """
+    return guess_extension(mimetype) or ".bin"
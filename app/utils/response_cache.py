@@ -0,0 +1,119 @@
+"""
+This module contains the ResponseCache class which keeps recently generated LLM responses in memory so that repeated requests over unchanged data can skip the LLM entirely.
+"""
+
+# External Libraries
+from dotenv import load_dotenv
+
+# Default Python Libraries
+from collections import OrderedDict
+from hashlib import sha256
+import os
+import time
+
+load_dotenv()
+
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+SUMMARY_CACHE_MAXSIZE = int(os.getenv("SUMMARY_CACHE_MAXSIZE", "1024"))
+
+
+class ResponseCache:
+    """
+    ResponseCache is a bounded, time-limited, in-memory cache of LLM responses.
+    Entries are grouped by user so that all of a user's responses can be invalidated when their data changes.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SUMMARY_CACHE_TTL,
+        maxsize: int = SUMMARY_CACHE_MAXSIZE,
+    ):
+        """
+        Initialize the ResponseCache.
+
+        Args:
+            ttl (float): The number of seconds an entry stays valid.
+            maxsize (int): The maximum number of entries kept before the least recently used is evicted.
+        """
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[str, float, str]] = OrderedDict()
+        self._user_keys: dict[str, set[str]] = {}
+
+    @staticmethod
+    def make_key(user_id: str, node_ids: list[str], model: str) -> str:
+        """
+        Build a cache key from the user, the retrieved node IDs and the model that generates the response.
+
+        Args:
+            user_id (str): The user ID the response belongs to.
+            node_ids (list[str]): The IDs of the nodes the response is generated from.
+            model (str): The name of the model generating the response.
+
+        Returns:
+            str: The cache key.
+        """
+        digest = sha256(user_id.encode())
+        for node_id in sorted(node_ids):
+            digest.update(b"\0")
+            digest.update(node_id.encode())
+        digest.update(b"\0")
+        digest.update(model.encode())
+        return digest.hexdigest()
+
+    async def lookup(self, key: str) -> str | None:
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): The cache key, see make_key.
+
+        Returns:
+            str | None: The cached response if present and not expired, None otherwise.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        user_id, expires_at, response = entry
+        if expires_at < time.monotonic():
+            self._remove(key, user_id)
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    async def update(self, key: str, user_id: str, response: str) -> None:
+        """
+        Store a response in the cache, evicting the least recently used entry if the cache is full.
+
+        Args:
+            key (str): The cache key, see make_key.
+            user_id (str): The user ID the response belongs to.
+            response (str): The response to cache.
+        """
+        self._entries[key] = (user_id, time.monotonic() + self._ttl, response)
+        self._entries.move_to_end(key)
+        self._user_keys.setdefault(user_id, set()).add(key)
+        while len(self._entries) > self._maxsize:
+            old_key, (old_user_id, _, _) = next(iter(self._entries.items()))
+            self._remove(old_key, old_user_id)
+
+    def invalidate(self, user_id: str) -> None:
+        """
+        Drop every cached response for a user, e.g. after new data has been ingested for them.
+
+        Args:
+            user_id (str): The user ID to invalidate.
+        """
+        for key in self._user_keys.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    def _remove(self, key: str, user_id: str) -> None:
+        self._entries.pop(key, None)
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+summary_cache = ResponseCache()
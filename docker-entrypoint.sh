@@ -6,4 +6,5 @@ set -e
 . /venv/bin/activate
 
 # run the command passed to the entrypoint
-exec gunicorn -k uvicorn.workers.UvicornWorker -c ./gunicorn_conf.py --timeout 600 --preload app.main:app --loop="asyncio"
\ No newline at end of file
+# UvicornWorker runs on uvloop with the httptools parser, both installed by uvicorn[standard]
+exec gunicorn -k uvicorn.workers.UvicornWorker -c ./gunicorn_conf.py --timeout 600 --preload app.main:app
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Tests for the AIActions retrieval helpers.
+"""
+
+# External Libraries
+from llama_index.schema import TextNode
+from llama_index.vector_stores import QdrantVectorStore
+from llama_index.vector_stores.types import MetadataFilter, MetadataFilters
+from qdrant_client import AsyncQdrantClient
+
+# Default Python Libraries
+import asyncio
+
+# Local Libraries
+from app.api.ai_actions import AIActions
+
+
+def user_filters(user_id: str) -> MetadataFilters:
+    """
+    Build the filters that restrict a search to one user, as AIActions does.
+    """
+    return MetadataFilters(
+        filters=[
+            MetadataFilter(
+                key="user_id",
+                value=user_id,
+            ),
+        ],
+    )
+
+
+def test_search_only_returns_the_users_nodes():
+    """
+    A search filtered on a user must not return another user's nodes, even when they are more similar.
+    """
+
+    async def search() -> list[str]:
+        vector_store = QdrantVectorStore(
+            collection_name="test",
+            aclient=AsyncQdrantClient(location=":memory:"),
+        )
+        await vector_store.async_add(
+            [
+                TextNode(
+                    text="secret of bob",
+                    metadata={"user_id": "bob"},
+                    embedding=[1.0, 0.0],
+                ),
+                TextNode(
+                    text="note of alice",
+                    metadata={"user_id": "alice"},
+                    embedding=[0.0, 1.0],
+                ),
+            ]
+        )
+        nodes = await AIActions()._search(
+            vector_store, [1.0, 0.0], user_filters("alice")
+        )
+        return [node.node.metadata["user_id"] for node in nodes]
+
+    assert asyncio.run(search()) == ["alice"]